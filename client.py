@@ -1,8 +1,26 @@
 # client.py
+import asyncio
+import contextlib
+import heapq
+import logging
 import os
+import queue
+import shelve
+import threading
 import time
+from datetime import date, timedelta
+from pathlib import Path
+import aiohttp
+import ijson
+import orjson
 import requests
-from typing import Iterator, Dict, Any, Optional
+from aiolimiter import AsyncLimiter
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+from urllib3.util.retry import RequestHistory, Retry
+from typing import AsyncIterator, Iterator, Dict, Any, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
 
 BASE_URL = "https://www.courtlistener.com/api/rest/v3"
 
@@ -11,6 +29,166 @@ MAX_RETRIES = int(os.getenv("COURTLISTENER_MAX_RETRIES", "6"))
 REQUEST_TIMEOUT = float(os.getenv("COURTLISTENER_TIMEOUT", "60"))  # seconds
 BACKOFF_FACTOR = float(os.getenv("COURTLISTENER_BACKOFF_FACTOR", "1.5"))
 
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+# urllib3's Retry only covers connecting and the status line; a page whose
+# body read fails before any of its items were yielded is re-requested once
+BODY_READ_ERRORS = (
+    ReadTimeoutError,
+    ProtocolError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+)
+BODY_READ_ATTEMPTS = 2
+
+# Pause until X-RateLimit-Reset once fewer than this many calls remain
+RATE_LIMIT_MIN_REMAINING = 2
+
+# Requests per second allowed across all calls made through one client
+RATE_LIMIT_RPS = float(os.getenv("COURTLISTENER_RPS", "2"))
+if RATE_LIMIT_RPS <= 0:
+    raise ValueError(f"COURTLISTENER_RPS must be positive, got {RATE_LIMIT_RPS}")
+
+# Largest page_size CourtListener accepts
+MAX_PAGE_SIZE = 100
+
+# Incremental page parsing only pays off with ijson's C backend; the pure
+# Python fallback is much slower than decoding a whole page with orjson
+STREAM_PAGES = ijson.backend == "yajl2_c"
+
+# How many fetched pages the async producer may buffer ahead of the consumer
+PREFETCH_PAGES = 2
+
+
+# Marks an exhausted page iterator in fetch_paginated's one-item lookahead
+_END = object()
+
+
+def _retry_after_seconds(headers, default: float) -> float:
+    try:
+        return max(0.0, float(headers.get("Retry-After", default)))
+    except (TypeError, ValueError):
+        # HTTP-date form of Retry-After; fall back to our own backoff
+        return default
+
+
+def _stream_results(
+    resp: requests.Response,
+    page: Dict[str, Any]
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the items of a page's "results" array as they are parsed off the
+    response stream. The page's "next" URL is recorded into `page`.
+    """
+    if not STREAM_PAGES:
+        data = orjson.loads(resp.content)
+        page["next"] = data.get("next")
+        return iter(data.get("results", []))
+
+    # resp.raw is the undecoded socket stream; let urllib3 un-gzip it
+    resp.raw.decode_content = True
+
+    def events():
+        for prefix, event, value in ijson.parse(resp.raw, use_float=True):
+            if prefix == "next":
+                page["next"] = value
+            yield prefix, event, value
+
+    return ijson.items(events(), "results.item")
+
+
+def _split_date_range(start: date, end: date, k: int) -> List[Tuple[date, date]]:
+    """
+    Split the inclusive range [start, end] into at most k contiguous,
+    non-overlapping, near equal-width sub-ranges.
+    """
+    if start > end:
+        raise ValueError(f"start {start} is after end {end}")
+    days = (end - start).days + 1
+    k = max(1, min(k, days))
+    bounds = [start + timedelta(days=i * days // k) for i in range(k + 1)]
+    return [(lo, hi - timedelta(days=1)) for lo, hi in zip(bounds, bounds[1:])]
+
+
+def _put_unless_stopped(q: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    """
+    Blocking put that gives up once `stop` is set; returns whether it put.
+    """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+class _LoggingRetry(Retry):
+    """
+    urllib3 Retry that reports every retry at WARNING; urllib3 itself only
+    logs them at DEBUG.
+    """
+
+    def increment(
+        self,
+        method=None,
+        url=None,
+        response=None,
+        error=None,
+        _pool=None,
+        _stacktrace=None
+    ):
+        new_retry = super().increment(
+            method, url, response, error, _pool, _stacktrace
+        )
+        sleep_for = None
+        if response is not None and new_retry.respect_retry_after_header:
+            sleep_for = new_retry.get_retry_after(response)
+        if sleep_for is None:
+            sleep_for = new_retry.get_backoff_time()
+        log.warning(
+            "Retrying %s after %s (retry %d/%d); sleeping %.1fs",
+            url,
+            error if error is not None else f"HTTP {response.status}",
+            len(new_retry.history),
+            MAX_RETRIES - 1,
+            sleep_for,
+        )
+        return new_retry
+
+
+class _TokenBucket:
+    """
+    Blocking token bucket guarding the sync request path.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity,
+                self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            time.sleep((1 - self.tokens) / self.rate)
+
+
+def _new_async_limiter(rate: float) -> AsyncLimiter:
+    # AsyncLimiter needs capacity for at least one request, so sub-1/s rates
+    # are expressed as one request per 1/rate seconds
+    if rate < 1:
+        return AsyncLimiter(1, 1 / rate)
+    return AsyncLimiter(rate, 1)
+
 
 def _get_user_agent() -> str:
     return os.getenv(
@@ -20,12 +198,41 @@ def _get_user_agent() -> str:
 
 
 class CourtListenerClient:
-    def __init__(self, token: Optional[str] = None, user_agent: Optional[str] = None):
+    def __init__(
+        self,
+        token: Optional[str] = None,
+        user_agent: Optional[str] = None,
+        etag_cache: Optional[Path] = None
+    ):
         self.session = requests.Session()
 
-        # Set User-Agent
+        # Retries with backoff (honoring Retry-After) are handled by urllib3.
+        # MAX_RETRIES counts total attempts, urllib3's `total` counts retries.
+        retry = _LoggingRetry(
+            total=max(0, MAX_RETRIES - 1),
+            backoff_factor=BACKOFF_FACTOR,
+            status_forcelist=RETRYABLE_STATUSES,
+            allowed_methods=["GET"],
+            respect_retry_after_header=True,
+        )
+
+        # Kept so the async path follows the same retry policy
+        self._retry = retry
+
+        # Larger connection pool so successive pages reuse one TLS connection
+        adapter = HTTPAdapter(
+            max_retries=retry,
+            pool_connections=4,
+            pool_maxsize=32,
+            pool_block=False,
+        )
+        self.session.mount("https://", adapter)
+
+        # Set User-Agent, keep-alive and compressed responses
         self.session.headers.update({
-            "User-Agent": user_agent or _get_user_agent()
+            "User-Agent": user_agent or _get_user_agent(),
+            "Connection": "keep-alive",
+            "Accept-Encoding": "gzip, deflate",
         })
 
         # Set Authorization token
@@ -35,102 +242,423 @@ class CourtListenerClient:
                 "Authorization": f"Token {token_to_use}"
             })
 
+        # Earliest time.time() at which the next request may be issued
+        self._next_allowed_ts = 0.0
+
+        # Issue-time rate limiting shared by every call on this client, so
+        # steady-state traffic never runs into a 429
+        self.limiter: Optional[AsyncLimiter] = None
+        self._limiter_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._bucket = _TokenBucket(RATE_LIMIT_RPS)
+
+        # Optional per-URL validators (ETag / Last-Modified), so unchanged pages
+        # come back as a bodiless 304. Validators of pages handed out in this
+        # run stay pending until commit_validators(), i.e. until the caller
+        # has safely stored their records.
+        self._etags: Optional[shelve.Shelf] = (
+            shelve.open(str(etag_cache)) if etag_cache else None
+        )
+        self._pending_validators: Dict[str, Dict[str, Any]] = {}
+
+    def commit_validators(self) -> None:
+        if self._etags is None:
+            return
+        for url, validators in self._pending_validators.items():
+            self._etags[url] = validators
+        self._pending_validators.clear()
+        self._etags.sync()
+
+    def close(self) -> None:
+        self.session.close()
+        if self._etags is not None:
+            self._etags.close()
+            self._etags = None
+
+    def _wait_for_rate_limit(self) -> float:
+        """
+        Return how many seconds to wait before the next request is allowed.
+        """
+        return max(0.0, self._next_allowed_ts - time.time())
+
+    def _get_limiter(self) -> AsyncLimiter:
+        """
+        Return the client's AsyncLimiter, rebinding it when called from a new
+        event loop (aiolimiter instances must not be shared across loops).
+        """
+        loop = asyncio.get_running_loop()
+        if self.limiter is None or self._limiter_loop is not loop:
+            self.limiter = _new_async_limiter(RATE_LIMIT_RPS)
+            self._limiter_loop = loop
+        return self.limiter
+
+    def _update_rate_limit(self, headers) -> None:
+        """
+        Pace successive calls using CourtListener's X-RateLimit-* headers.
+        """
+        try:
+            remaining = int(headers["X-RateLimit-Remaining"])
+            reset = float(headers["X-RateLimit-Reset"])
+        except (KeyError, TypeError, ValueError):
+            return
+
+        if remaining < RATE_LIMIT_MIN_REMAINING:
+            self._next_allowed_ts = max(self._next_allowed_ts, reset)
+
     def _get_with_retries(
         self,
-        url: str,
-        params: Optional[Dict[str, Any]] = None
+        prepared: requests.PreparedRequest,
+        send_kwargs: Dict[str, Any]
     ) -> requests.Response:
-        attempt = 0
+        delay = self._wait_for_rate_limit()
+        if delay:
+            log.info("Rate limit nearly exhausted; sleeping %.1fs", delay)
+            time.sleep(delay)
+
+        prepared.headers.pop("If-None-Match", None)
+        prepared.headers.pop("If-Modified-Since", None)
+        cached = None
+        if self._etags is not None and prepared.url not in self._pending_validators:
+            cached = self._etags.get(prepared.url)
+        if cached:
+            if cached.get("etag"):
+                prepared.headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                prepared.headers["If-Modified-Since"] = cached["last_modified"]
+
+        self._bucket.acquire()
+        log.debug("Requesting url=%s", prepared.url)
+        resp = self.session.send(
+            prepared,
+            timeout=REQUEST_TIMEOUT,
+            **send_kwargs
+        )
+        # CourtListener serves UTF-8; skip charset detection if .text is ever used
+        resp.encoding = "utf-8"
+        try:
+            resp.raise_for_status()
+        except requests.HTTPError:
+            # Streamed body is never read; hand the connection back to the pool
+            resp.close()
+            raise
+        self._update_rate_limit(resp.headers)
+        return resp
+
+    def fetch_paginated(
+        self,
+        endpoint: str,
+        params: Optional[Dict[str, Any]] = None
+    ) -> Iterator[Dict[str, Any]]:
+
+        url = f"{BASE_URL.rstrip('/')}/{endpoint.lstrip('/')}"
+
+        # Headers, auth and environment settings are merged once; later pages
+        # only swap in the absolute "next" URL returned by the API
+        prepared = self.session.prepare_request(
+            requests.Request("GET", url, params=params)
+        )
+        send_kwargs = self.session.merge_environment_settings(
+            prepared.url, {}, True, None, None
+        )
 
         while True:
-            attempt += 1
-            try:
-                print(f"\nRequesting (attempt {attempt}): {url}")
-                print(f"Params: {params}")
+            page_url = prepared.url
+            next_url = None
 
-                resp = self.session.get(
-                    url,
-                    params=params,
-                    timeout=REQUEST_TIMEOUT
-                )
+            for attempt in range(1, BODY_READ_ATTEMPTS + 1):
+                resp = self._get_with_retries(prepared, send_kwargs)
 
-                # ---- DEBUG / VERIFICATION OUTPUT ----
-                print("HTTP STATUS:", resp.status_code)
+                if resp.status_code == 304:
+                    # Unchanged since the last run, so the rest of the listing
+                    # was already synced as well; stop instead of walking into
+                    # older pages
+                    resp.close()
+                    log.debug("Not modified: %s", page_url)
+                    return
 
-                # Retryable status codes
-                if resp.status_code in (429, 500, 502, 503, 504):
-                    print(f"Transient HTTP {resp.status_code}; retrying...")
-                    raise requests.HTTPError(
-                        f"HTTP {resp.status_code}", response=resp
-                    )
+                page: Dict[str, Any] = {}
+                yielded = False
+                try:
+                    items = _stream_results(resp, page)
+                    item = next(items, _END)
+                    if item is _END:
+                        self._store_validators(page_url, resp.headers)
+                    while item is not _END:
+                        following = next(items, _END)
+                        if following is _END:
+                            # The page is fully handed out once this item is
+                            # yielded; the consumer may stop right after it
+                            self._store_validators(page_url, resp.headers)
+                        yielded = True
+                        yield item
+                        item = following
+                except BODY_READ_ERRORS as e:
+                    if yielded or attempt == BODY_READ_ATTEMPTS:
+                        raise
+                    log.warning("Reading %s failed (%s); requesting it again", page_url, e)
+                    continue
+                except (ijson.JSONError, orjson.JSONDecodeError):
+                    log.error("Failed to parse JSON response from %s", resp.url)
+                    raise
+                finally:
+                    resp.close()
 
-                resp.raise_for_status()
+                next_url = page.get("next")
+                break
 
-                # Confirm JSON structure
-                data = resp.json()
-                print("Response keys:", data.keys())
-                print("Records in this page:", len(data.get("results", [])))
+            if not next_url:
+                break
+            prepared.url = next_url
 
-                return resp
+    def _store_validators(self, url: str, headers) -> None:
+        if self._etags is None:
+            return
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if etag or last_modified:
+            self._pending_validators[url] = {
+                "etag": etag,
+                "last_modified": last_modified,
+            }
 
-            except requests.exceptions.ReadTimeout as e:
-                print(f"ReadTimeout on attempt {attempt}/{MAX_RETRIES}: {e}")
+    async def _aget_with_retries(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        params: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        # Same retry budget and backoff schedule as the sync adapter
+        retry = self._retry
+        attempt = 0
 
-            except requests.exceptions.ConnectionError as e:
-                print(f"ConnectionError on attempt {attempt}/{MAX_RETRIES}: {e}")
+        while True:
+            attempt += 1
 
-            except requests.HTTPError as e:
-                status = getattr(e.response, "status_code", None)
-                if status in (429, 500, 502, 503, 504):
-                    print(f"Retryable HTTP error {status}")
-                else:
-                    print(f"Non-retryable HTTP error {status}; aborting.")
-                    raise
+            delay = self._wait_for_rate_limit()
+            if delay:
+                log.info("Rate limit nearly exhausted; sleeping %.1fs", delay)
+                await asyncio.sleep(delay)
 
-            except requests.RequestException as e:
-                print(f"RequestException: {e}")
-                raise
+            log.debug("Requesting attempt=%d url=%s params=%s", attempt, url, params)
+            status = None
+            headers = None
+            try:
+                await self._get_limiter().acquire()
+                async with session.get(url, params=params) as resp:
+                    if resp.status not in RETRYABLE_STATUSES:
+                        resp.raise_for_status()
+                        self._update_rate_limit(resp.headers)
+                        return orjson.loads(await resp.read())
+                    status, headers = resp.status, resp.headers
+                    reason = f"HTTP {resp.status}"
+
+            except (asyncio.TimeoutError, aiohttp.ClientConnectionError) as e:
+                reason = repr(e)
 
-            if attempt >= MAX_RETRIES:
+            retry = retry.new(
+                total=retry.total - 1,
+                history=retry.history + (RequestHistory("GET", url, None, status, None),),
+            )
+            if retry.is_exhausted():
                 raise requests.exceptions.RetryError(
                     f"Failed after {MAX_RETRIES} attempts to GET {url}"
                 )
 
-            sleep_for = BACKOFF_FACTOR * (2 ** (attempt - 1))
-            print(f"Sleeping {sleep_for:.1f}s before retry...")
-            time.sleep(sleep_for)
+            sleep_for = retry.get_backoff_time()
+            if headers is not None:
+                sleep_for = _retry_after_seconds(headers, sleep_for)
+            log.warning(
+                "Retrying %s after %s (retry %d/%d); sleeping %.1fs",
+                url, reason, len(retry.history), MAX_RETRIES - 1, sleep_for
+            )
+            await asyncio.sleep(sleep_for)
 
-    def fetch_paginated(
+    def _async_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(limit_per_host=8, keepalive_timeout=75)
+        return aiohttp.ClientSession(
+            connector=connector,
+            headers=dict(self.session.headers),
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+        )
+
+    async def _apages(
         self,
         endpoint: str,
+        params: Optional[Dict[str, Any]] = None,
+        session: Optional[aiohttp.ClientSession] = None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Yield each page's "results" list. A producer task fetches the next
+        page while the caller is still consuming the current one.
+        """
+        url = f"{BASE_URL.rstrip('/')}/{endpoint.lstrip('/')}"
+        buffer: asyncio.Queue = asyncio.Queue(maxsize=PREFETCH_PAGES)
+
+        async def produce(session: aiohttp.ClientSession):
+            next_url, next_params = url, params
+            try:
+                while next_url:
+                    data = await self._aget_with_retries(session, next_url, next_params)
+                    next_url, next_params = data.get("next"), None
+                    await buffer.put((data.get("results", []), None))
+            except Exception as e:
+                await buffer.put((None, e))
+            else:
+                await buffer.put((None, None))
+
+        async with contextlib.AsyncExitStack() as stack:
+            if session is None:
+                session = await stack.enter_async_context(self._async_session())
+            producer = asyncio.create_task(produce(session))
+            try:
+                while True:
+                    items, error = await buffer.get()
+                    if error is not None:
+                        raise error
+                    if items is None:
+                        break
+                    yield items
+            finally:
+                producer.cancel()
+                try:
+                    await producer
+                except asyncio.CancelledError:
+                    pass
+
+    async def afetch_paginated(
+        self,
+        endpoint: str,
+        params: Optional[Dict[str, Any]] = None,
+        session: Optional[aiohttp.ClientSession] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Async variant of fetch_paginated with next-page prefetch. Pass
+        `session` to share one connection pool between several walks.
+        """
+        async with contextlib.aclosing(
+            self._apages(endpoint, params, session)
+        ) as pages:
+            async for items in pages:
+                for item in items:
+                    yield item
+
+    def fetch_paginated_parallel(
+        self,
+        endpoint: str,
+        date_field: str,
+        start: date,
+        end: date,
+        k: int = 8,
         params: Optional[Dict[str, Any]] = None
     ) -> Iterator[Dict[str, Any]]:
+        """
+        Split [start, end] on `date_field` into k sub-ranges, walk their
+        cursors concurrently and lazily merge the results ordered by
+        `date_field`. Each cursor buffers at most PREFETCH_PAGES pages ahead
+        of the caller. All k cursors share one connection pool and the
+        client's limiter, so the combined request rate stays within
+        RATE_LIMIT_RPS.
+        """
+        ranges = _split_date_range(start, end, k)
+        queues = [queue.Queue(maxsize=PREFETCH_PAGES) for _ in ranges]
+        stop = threading.Event()
+        running: Dict[str, Any] = {}
 
-        url = f"{BASE_URL.rstrip('/')}/{endpoint.lstrip('/')}"
-        first_request = True
-
-        while url:
-            resp = self._get_with_retries(
-                url,
-                params if first_request else None
-            )
+        async def walk(
+            session: aiohttp.ClientSession,
+            out: queue.Queue,
+            lo: date,
+            hi: date
+        ):
+            sub_params = dict(params or {})
+            sub_params.update({
+                f"{date_field}_min": lo.isoformat(),
+                f"{date_field}_max": hi.isoformat(),
+                "order_by": date_field,
+            })
+            try:
+                async with contextlib.aclosing(
+                    self._apages(endpoint, sub_params, session)
+                ) as pages:
+                    async for items in pages:
+                        put = await asyncio.to_thread(
+                            _put_unless_stopped, out, (items, None), stop
+                        )
+                        if not put:
+                            return
+            except Exception as e:
+                await asyncio.to_thread(_put_unless_stopped, out, (None, e), stop)
+            else:
+                await asyncio.to_thread(_put_unless_stopped, out, (None, None), stop)
 
+        async def walk_all():
+            running["loop"] = asyncio.get_running_loop()
+            running["task"] = asyncio.current_task()
+            if stop.is_set():
+                return
             try:
-                data = resp.json()
-            except Exception:
-                print("Failed to parse JSON response:")
-                print(resp.text[:1000])
-                raise
+                async with self._async_session() as session:
+                    await asyncio.gather(*(
+                        walk(session, out, lo, hi)
+                        for out, (lo, hi) in zip(queues, ranges)
+                    ))
+            except asyncio.CancelledError:
+                # The caller stopped consuming; in-flight fetches are dropped
+                pass
+            except Exception as e:
+                for out in queues:
+                    await asyncio.to_thread(_put_unless_stopped, out, (None, e), stop)
 
-            for item in data.get("results", []):
-                yield item
+        def drain(q: queue.Queue) -> Iterator[Dict[str, Any]]:
+            while True:
+                items, error = q.get()
+                if error is not None:
+                    raise error
+                if items is None:
+                    return
+                yield from items
+
+        def merged() -> Iterator[Dict[str, Any]]:
+            # The cursors run on their own event loop in a background thread
+            worker = threading.Thread(
+                target=asyncio.run, args=(walk_all(),), daemon=True
+            )
+            worker.start()
+            try:
+                yield from heapq.merge(
+                    *(drain(q) for q in queues),
+                    key=lambda item: item.get(date_field) or ""
+                )
+            finally:
+                stop.set()
+                if "loop" in running:
+                    try:
+                        running["loop"].call_soon_threadsafe(running["task"].cancel)
+                    except RuntimeError:
+                        pass  # the loop already finished
+                worker.join()
 
-            first_request = False
-            params = None
-            url = data.get("next")
+        return merged()
 
-    def opinions(self, **filters) -> Iterator[Dict[str, Any]]:
+    def opinions(
+        self,
+        page_size: Optional[int] = None,
+        **filters
+    ) -> Iterator[Dict[str, Any]]:
         """
         Fetch court opinions using CourtListener API.
         """
+        if page_size is not None:
+            filters["page_size"] = min(page_size, MAX_PAGE_SIZE)
         return self.fetch_paginated("/opinions/", filters)
+
+    def aopinions(
+        self,
+        page_size: Optional[int] = None,
+        **filters
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Async variant of opinions() with next-page prefetch.
+        """
+        if page_size is not None:
+            filters["page_size"] = min(page_size, MAX_PAGE_SIZE)
+        return self.afetch_paginated("/opinions/", filters)
@@ -1,43 +1,90 @@
 # main.py
 import argparse
-import json
+import logging
 import os
+import time
+import orjson
 from pathlib import Path
-from typing import Iterable, Dict, Any, List, Optional
-from client import CourtListenerClient
+from typing import Dict, Any, FrozenSet, Optional
+from client import CourtListenerClient, MAX_PAGE_SIZE
 
 DATA_DIR = Path("data")
-USERS_FILE = DATA_DIR / "users.json"
+USERS_FILE = DATA_DIR / "users.jsonl"
+LEGACY_USERS_FILE = DATA_DIR / "users.json"
+
+# Output buffer size; JSONL lines are flushed to disk in ~1 MiB writes
+WRITE_BUFFER_SIZE = 1 << 20
 
 
 def ensure_users_file():
     DATA_DIR.mkdir(exist_ok=True)
-    if not USERS_FILE.exists():
-        USERS_FILE.write_text(json.dumps({"users": []}, indent=2), encoding="utf-8")
-
+    if not USERS_FILE.exists() and LEGACY_USERS_FILE.exists():
+        migrate_legacy_users_file()
+    USERS_FILE.touch(exist_ok=True)
 
-def add_user_record(username: str, file_path: Path):
-    ensure_users_file()
-    db = json.loads(USERS_FILE.read_text(encoding="utf-8"))
-    user = next((u for u in db["users"] if u["username"] == username), None)
-    if not user:
-        user = {"username": username, "saved_files": []}
-        db["users"].append(user)
-    user["saved_files"].append(str(file_path))
-    USERS_FILE.write_text(json.dumps(db, indent=2), encoding="utf-8")
 
-
-def save_jsonl(path: Path, items: Iterable[Dict[str, Any]]):
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8") as f:
-        for item in items:
-            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+def migrate_legacy_users_file():
+    """
+    Seed users.jsonl from a pre-ledger users.json index, which is left in place.
+    """
+    try:
+        db = orjson.loads(LEGACY_USERS_FILE.read_bytes())
+        ts = LEGACY_USERS_FILE.stat().st_mtime
+        payload = b"".join(
+            orjson.dumps({"username": u["username"], "file": f, "ts": ts}) + b"\n"
+            for u in db.get("users", [])
+            for f in u.get("saved_files", [])
+        )
+    except (OSError, orjson.JSONDecodeError, KeyError, TypeError, AttributeError) as e:
+        print(f"Ignoring unreadable legacy user index {LEGACY_USERS_FILE}: {e}")
+        return
+    atomic_write_bytes(USERS_FILE, payload)
+    print(f"Migrated legacy user index {LEGACY_USERS_FILE} to {USERS_FILE}")
 
 
-def filter_fields(record: Dict[str, Any], fields: Optional[List[str]]) -> Dict[str, Any]:
+def add_user_record(username: str, file_path: Path):
+    # Append-only ledger: one small O_APPEND write per run, no full rewrite
+    ensure_users_file()
+    entry = {"username": username, "file": str(file_path), "ts": time.time()}
+    line = orjson.dumps(entry) + b"\n"
+    with USERS_FILE.open("ab+") as f:
+        # After an interrupted write the last line has no newline; start a
+        # fresh line so only the torn entry is lost, not this one as well
+        if f.seek(0, os.SEEK_END):
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                line = b"\n" + line
+        f.write(line)
+
+
+def load_user_index() -> Dict[str, Any]:
+    """
+    Fold the users.jsonl ledger into {"users": [{"username", "saved_files"}]}.
+    """
+    users: Dict[str, Dict[str, Any]] = {}
+    if not USERS_FILE.exists() and LEGACY_USERS_FILE.exists():
+        ensure_users_file()
+    if USERS_FILE.exists():
+        with USERS_FILE.open("rb") as f:
+            for line in f:
+                try:
+                    entry = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    # Torn final line from an interrupted write
+                    continue
+                user = users.setdefault(
+                    entry["username"],
+                    {"username": entry["username"], "saved_files": []}
+                )
+                if entry["file"] not in user["saved_files"]:
+                    user["saved_files"].append(entry["file"])
+    return {"users": list(users.values())}
+
+
+def filter_fields(record: Dict[str, Any], fields: Optional[FrozenSet[str]]) -> Dict[str, Any]:
     if not fields:
         return record
-    return {k: record[k] for k in fields if k in record}
+    return {k: v for k, v in record.items() if k in fields}
 
 
 def read_since_file(path: Path) -> Optional[str]:
@@ -50,26 +97,37 @@ def read_since_file(path: Path) -> Optional[str]:
         return None
 
 
+def atomic_write_bytes(path: Path, payload: bytes):
+    # Write a sibling temp file, then swap it in so readers never see a torn file
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_bytes(payload)
+    os.replace(tmp, path)
+
+
 def write_since_file(path: Path, date_str: str):
+    date_str = date_str.strip()
+    if read_since_file(path) == date_str:
+        return
     path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_text(date_str.strip(), encoding="utf-8")
+    atomic_write_bytes(path, date_str.encode("utf-8"))
 
 
 def extract_date_filed(opinion: Dict[str, Any]) -> Optional[str]:
     df = opinion.get("date_filed")
+    if isinstance(df, str):
+        # Common case: already an ISO string, no str() round-trip needed
+        return df[:10]
     return str(df)[:10] if df else None
 
 
-def print_summary(records: List[Dict[str, Any]]):
+def print_summary(count: int, r: Optional[Dict[str, Any]]):
     print("\nSummary:")
-    print(f"- Records saved: {len(records)}")
+    print(f"- Records saved: {count}")
 
-    if not records:
+    if r is None:
         print("- No records to summarize")
         return
 
-    r = records[0]
-
     print(f"- Opinion ID: {r.get('id', 'N/A')}")
     print(f"- Case URL: {r.get('absolute_url', 'N/A')}")
     print(f"- Date filed: {r.get('date_filed', 'N/A')}")
@@ -92,14 +150,28 @@ def main():
     parser.add_argument("--ua", help="User-Agent string")
     parser.add_argument("--fields", help="Comma-separated fields to save")
     parser.add_argument("--since-file", help="Path to since-file for incremental sync")
+    parser.add_argument("--verbose", action="store_true", help="Log every API request")
     args = parser.parse_args()
 
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(message)s"
+    )
+
     token = args.token or os.getenv("COURTLISTENER_TOKEN")
     ua = args.ua or os.getenv("COURTLISTENER_UA")
-    client = CourtListenerClient(token=token, user_agent=ua)
 
     date_min = args.date_min
     since_path = Path(args.since_file) if args.since_file else None
+
+    # Incremental runs revalidate pages with If-None-Match / If-Modified-Since.
+    # Validators live next to the since-file, so each sync stream has its own
+    # and one consumer's 304s can never hide records from another.
+    etag_cache = None
+    if since_path:
+        since_path.parent.mkdir(parents=True, exist_ok=True)
+        etag_cache = since_path.with_name(since_path.name + ".etags")
+    client = CourtListenerClient(token=token, user_agent=ua, etag_cache=etag_cache)
     if not date_min and since_path:
         stored = read_since_file(since_path)
         if stored:
@@ -107,40 +179,81 @@ def main():
             print(f"Using since-file date_filed_min from {since_path}: {date_min}")
 
     fields_list = None
+    fields_set = None
     if args.fields:
         fields_list = [f.strip() for f in args.fields.split(",") if f.strip()]
+        fields_set = frozenset(fields_list)
         print(f"Saving only fields: {fields_list}")
 
     filters = {}
     if date_min:
         filters["date_filed_min"] = date_min
 
-    print(f"Fetching up to {args.limit} opinions ...")
+    if fields_list:
+        # Server-side projection; filter_fields() below stays as a safety net.
+        # date_filed is still needed to advance the since-file.
+        server_fields = list(fields_list)
+        if since_path and "date_filed" not in server_fields:
+            server_fields.append("date_filed")
+        filters["fields"] = ",".join(server_fields)
 
-    collected: List[Dict[str, Any]] = []
-    newest_date = None
+    page_size = None
+    if args.limit > 0:
+        # Small limits are served by a single, right-sized page
+        page_size = min(args.limit, MAX_PAGE_SIZE)
 
-    try:
-        for i, rec in enumerate(client.opinions(**filters), start=1):
-            d = extract_date_filed(rec)
-            if d and (newest_date is None or d > newest_date):
-                newest_date = d
-
-            collected.append(filter_fields(rec, fields_list))
-
-            if i >= args.limit:
-                break
-    except Exception as e:
-        print("Error while fetching:", e)
-        if not collected:
-            raise
+    print(f"Fetching up to {args.limit} opinions ...")
 
     output_file = DATA_DIR / f"{args.user}_opinions.jsonl"
-    save_jsonl(output_file, collected)
-    add_user_record(args.user, output_file)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
 
-    print(f"Saved {len(collected)} records to {output_file}")
-    print(f"User data index updated: {USERS_FILE}")
+    # Records are written as they arrive; only O(1) summary state is kept.
+    # They go to a sibling temp file so a failed run leaves the old output intact.
+    tmp_file = output_file.with_suffix(output_file.suffix + ".tmp")
+    saved = 0
+    newest_date = None
+    first_record = None
+    error = None
+
+    try:
+        with tmp_file.open("wb", buffering=WRITE_BUFFER_SIZE) as f:
+            try:
+                for i, rec in enumerate(client.opinions(page_size=page_size, **filters), start=1):
+                    d = extract_date_filed(rec)
+                    if d and (newest_date is None or d > newest_date):
+                        newest_date = d
+
+                    out = rec if fields_set is None else filter_fields(rec, fields_set)
+                    f.write(orjson.dumps(out) + b"\n")
+                    saved = i
+                    if first_record is None:
+                        first_record = out
+
+                    if i >= args.limit:
+                        break
+            except Exception as e:
+                print("Error while fetching:", e)
+                error = e
+
+        if error is not None and not saved:
+            tmp_file.unlink()
+            raise error
+
+        if not saved and etag_cache is not None and output_file.exists():
+            # Nothing new (the first page revalidated as 304); keep the last output
+            tmp_file.unlink()
+            print(f"No new records; keeping existing {output_file}")
+        else:
+            os.replace(tmp_file, output_file)
+            add_user_record(args.user, output_file)
+            print(f"Saved {saved} records to {output_file}")
+            print(f"User data index updated: {USERS_FILE}")
+
+        # Only now are the handed-out records on disk, so their pages may be
+        # revalidated as 304 next time
+        client.commit_validators()
+    finally:
+        client.close()
 
     if since_path and newest_date:
         try:
@@ -150,7 +263,7 @@ def main():
             print(f"Failed to write since-file {since_path}: {e}")
 
     # 🔹 NEW: print terminal summary
-    print_summary(collected)
+    print_summary(saved, first_record)
 
 
 if __name__ == "__main__":